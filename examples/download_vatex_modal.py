@@ -50,7 +50,20 @@ def download_and_process_vatex(cookies_texts: list[str], hf_dataset_name: str):
     local_json_path = "/data/vatex_training_v1.0.json"
 
     print(f"Downloading {json_url} to {local_json_path}...")
-    subprocess.run(["wget", "-O", local_json_path, json_url], check=True)
+    # aria2 is already in the image and fetches the file over parallel range requests instead of one connection
+    subprocess.run(
+        [
+            "aria2c",
+            "-x", "16",
+            "-s", "16",
+            "-k", "1M",
+            "--allow-overwrite=true",
+            "-o", os.path.basename(local_json_path),
+            "-d", os.path.dirname(local_json_path),
+            json_url,
+        ],
+        check=True,
+    )
     print("Download complete.")
 
     cookies_paths = []
@@ -87,14 +100,16 @@ def download_and_process_vatex(cookies_texts: list[str], hf_dataset_name: str):
     print("Volume committed. VaTeX dataset is now persisted.")
 
     print("Uploading dataset to Huggingface")
-    huggingface_upload_command = [
-        "huggingface-cli",
-        "upload",
-        hf_dataset_name,
-        output_folder_in_volume,
-        "--repo-type=dataset"
-    ]
-    subprocess.run(huggingface_upload_command, check=True)
+    # Only installed in the image, not needed by the local entrypoint
+    from huggingface_hub import HfApi
+
+    # Uploads the shards with parallel workers over several commits (through hf_transfer, enabled
+    # in the image) and can resume from its cache in the folder if the upload is interrupted
+    HfApi().upload_large_folder(
+        repo_id=hf_dataset_name,
+        folder_path=output_folder_in_volume,
+        repo_type="dataset",
+    )
     print(f"\n\n{'-'*50}\n\nFinished uploading dataset: https://huggingface.co/datasets/{hf_dataset_name}")
 
 @app.local_entrypoint()
@@ -1,11 +1,13 @@
+import ijson
 import json
-import subprocess
 import argparse
 import logging
 import sys
 import os
-import multiprocessing
-import glob  # Import the glob module
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import yt_dlp
+from yt_dlp.utils import download_range_func
 from tqdm import tqdm
 
 # --- Setup Logging ---
@@ -15,26 +17,98 @@ logging.basicConfig(
     stream=sys.stdout
 )
 
-def download_worker(task_args):
+# Permanently failed clips are remembered here (inside the output directory) so that
+# later runs don't retry them. Maps videoID -> failure reason.
+FAILED_FILE_NAME = '.failed.json'
+
+# Substrings of yt-dlp error messages, checked in order, used to tell permanent
+# failures (worth caching) from transient ones.
+FAILURE_REASONS = (
+    # YouTube's throttling message also starts with "Video unavailable", so this is checked first
+    ('ratelimit', ('HTTP Error 429', 'rate-limit', 'rate limit',
+                   'confirm you’re not a bot', "confirm you're not a bot",
+                   'try again later', 'isn’t available, try again', "isn't available, try again")),
+    ('geoblock', ('not available in your country', 'geo restrict', 'geo-restrict')),
+    # Only specific messages, never the generic "Video unavailable" prefix
+    ('removed', ('Private video', 'This video has been removed', 'This video is no longer available',
+                 'account associated with this video has been terminated',
+                 'This video is unavailable', 'video has been removed by the uploader')),
+)
+
+# Only these reasons are cached, rate limits (and unknown errors) are worth retrying.
+PERMANENT_FAILURE_REASONS = {'geoblock', 'removed'}
+
+def classify_failure(message):
+    """Maps a yt-dlp error message to one of the FAILURE_REASONS, or 'error' if none match."""
+    for reason, patterns in FAILURE_REASONS:
+        if any(pattern in message for pattern in patterns):
+            return reason
+    return 'error'
+
+def load_failed_ids(output_dir):
+    """Loads the {videoID: reason} dict of permanently failed clips, empty if there is none yet."""
+    try:
+        with open(os.path.join(output_dir, FAILED_FILE_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logging.warning(f"Ignoring unreadable '{FAILED_FILE_NAME}' in '{output_dir}'.")
+        return {}
+
+def save_failed_ids(output_dir, failed_ids):
+    """Writes the {videoID: reason} dict of permanently failed clips, replacing the previous one."""
+    failed_path = os.path.join(output_dir, FAILED_FILE_NAME)
+    tmp_path = failed_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(failed_ids, f)
+    os.replace(tmp_path, failed_path)
+
+# One YoutubeDL instance per download thread, built on first use and reused for
+# every clip that thread handles. Instances are not shared because per-clip
+# options are swapped into their params.
+_thread_state = threading.local()
+
+def get_ydl():
+    """
+    Returns the long-lived YoutubeDL instance of the calling thread.
+
+    Setting up yt-dlp and its extractors is expensive, so it is done once per
+    thread instead of once per clip.
+    """
+    ydl = getattr(_thread_state, 'ydl', None)
+    if ydl is not None:
+        return ydl
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        # Nothing reads the progress output, don't build the progress lines at all
+        'noprogress': True,
+        'force_keyframes_at_cuts': True,
+        'postprocessors': [{'key': 'FFmpegVideoRemuxer', 'preferedformat': 'mp4'}],
+    }
+    ydl = _thread_state.ydl = yt_dlp.YoutubeDL(ydl_opts)
+    return ydl
+
+def download_worker(video_info_string, output_dir):
     """
     The worker function for a single download task.
-    This function is executed by each process in the multiprocessing pool.
+    This function is executed by each thread in the thread pool,
+    using the thread's YoutubeDL instance from `get_ydl`.
 
     Args:
-        task_args (tuple): A tuple containing (item, output_dir).
-                           - item (dict): The video dictionary from the JSON.
-                           - output_dir (str): The directory to save the video.
+        video_info_string (str): The videoID of the JSON entry, None if the entry has none.
+        output_dir (str): The directory to save the video.
 
     Returns:
-        tuple: A tuple containing (bool, str) for success/failure and the video_info_string.
-               e.g., (True, 'video_id_...') or (False, 'video_id_...')
+        tuple: A tuple containing (bool, str, str) for success/failure, the video_info_string
+               and the outcome: 'ok', one of the FAILURE_REASONS, 'malformed' or 'error'.
+               e.g., (True, 'video_id_...', 'ok') or (False, 'video_id_...', 'removed')
     """
-    item, output_dir = task_args
-    video_info_string = None  # Initialize in case of early failure
-
     try:
-        # Get the full video info string (e.g., 'bjtnAh_wz1c_000002_000012')
-        video_info_string = item['videoID']
+        # The full video info string (e.g., 'bjtnAh_wz1c_000002_000012')
+        if video_info_string is None:
+            raise ValueError("entry has no videoID string.")
 
         # This logic is now robust against underscores in the video ID
         parts = video_info_string.split('_')
@@ -48,107 +122,137 @@ def download_worker(task_args):
         start_seconds = int(start_time)
         end_seconds = int(end_time)
 
-    except (KeyError, ValueError) as e:
-        logging.warning(f"Skipping entry due to malformed data: {item}. Error: {e}")
-        # Return failure with a placeholder if video_info_string could not be parsed
-        return False, (video_info_string or f"malformed_data:_{item}")
+    except ValueError as e:
+        logging.warning(f"Skipping entry due to malformed data: {video_info_string}. Error: {e}")
+        # Return failure with a placeholder if the entry had no videoID
+        return False, (video_info_string or "malformed_data"), 'malformed'
 
     # Define the full output path for the video file
     output_path_template = os.path.join(output_dir, f"{video_info_string}.%(ext)s")
     youtube_url = f"https://www.youtube.com/watch?v={video_id}"
 
-    command = [
-        'yt-dlp',
-        '--quiet', '--no-warnings',
-        '-o', output_path_template,  # Use -o as a shorthand for --output
-        '--download-sections', f"*{start_seconds}-{end_seconds}",
-        '--force-keyframes-at-cuts',
-        '--remux-video', 'mp4',
-        youtube_url
-    ]
+    # The output name and clip section are the only per-clip options, so they are
+    # swapped into the reused instance instead of building a new one.
+    ydl = get_ydl()
+    ydl.params['outtmpl']['default'] = output_path_template
+    ydl.params['download_ranges'] = download_range_func(None, [(start_seconds, end_seconds)])
 
     try:
-        # Using capture_output=True and text=True to get stdout/stderr if needed
-        subprocess.run(command, check=True, capture_output=True, text=True)
-        return True, video_info_string
-    except FileNotFoundError:
-        logging.error("CRITICAL: 'yt-dlp' command not found. Please ensure it's installed and in your PATH.")
-        # This error is critical and will likely affect all workers, but we return failure for this task.
-        return False, video_info_string
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to download {video_info_string}. Reason: {e.stderr.strip()}")
-        return False, video_info_string
+        ret_code = ydl.download([youtube_url])
+        if ret_code != 0:
+            logging.error(f"Failed to download {video_info_string}. yt-dlp exited with status {ret_code}")
+            return False, video_info_string, 'error'
+        return True, video_info_string, 'ok'
+    except yt_dlp.utils.DownloadError as e:
+        message = str(e).strip()
+        logging.error(f"Failed to download {video_info_string}. Reason: {message}")
+        return False, video_info_string, classify_failure(message)
     except Exception as e:
         logging.error(f"An unexpected error occurred for {video_info_string}: {e}")
-        return False, video_info_string
+        return False, video_info_string, 'error'
 
-def process_downloads(json_file_path, output_dir, num_jobs):
+def process_downloads(json_file_path, output_dir, num_jobs, retry_failed=False):
     """
-    Orchestrates the parallel downloading of video segments, skipping existing files.
+    Orchestrates the parallel downloading of video segments, skipping existing files
+    and clips that already failed permanently in a previous run.
 
     Args:
         json_file_path (str): The path to the input JSON file.
         output_dir (str): The directory to save downloaded videos.
-        num_jobs (int): The number of parallel processes to use.
+        num_jobs (int): The number of parallel download threads to use.
+        retry_failed (bool): Whether to retry the clips recorded as permanently failed.
     """
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            video_data = json.load(f)
-        logging.info(f"Loaded {len(video_data)} video entries from '{json_file_path}'.")
+        json_file = open(json_file_path, 'rb')
     except FileNotFoundError:
         logging.error(f"Error: The file '{json_file_path}' was not found.")
         sys.exit(1)
-    except json.JSONDecodeError:
-        logging.error(f"Error: Failed to decode JSON from '{json_file_path}'. Check format.")
-        sys.exit(1)
 
     os.makedirs(output_dir, exist_ok=True)
     logging.info(f"Output directory set to '{output_dir}'.")
 
     # --- NEW: Pre-filter tasks to implement resumability ---
-    tasks_to_run = []
     skipped_count = 0
+    skipped_failed_count = 0
     logging.info("Checking for existing files to skip...")
 
-    for item in tqdm(video_data, desc="Scanning for existing files"):
-        try:
-            video_info_string = item['videoID']
-            # Create a pattern to match filename with any extension
-            file_pattern = os.path.join(output_dir, f"{video_info_string}.*")
-            # Use glob.glob to find if any file matches the pattern
-            if glob.glob(file_pattern):
+    failed_ids = load_failed_ids(output_dir)
+    if retry_failed:
+        failed_ids = {}
+    elif failed_ids:
+        logging.info(f"Loaded {len(failed_ids)} permanently failed clips to skip.")
+
+    # List the output directory once and keep the names without their extension(s),
+    # so every entry is checked with a set lookup instead of a directory scan.
+    # Like the "{videoID}.*" pattern this replaces, anything after the first dot
+    # (e.g. ".mp4" or ".mp4.part") is ignored.
+    with os.scandir(output_dir) as entries:
+        existing_files = {entry.name.partition('.')[0] for entry in entries if entry.is_file()}
+
+    def pending_ids():
+        """
+        Streams the JSON entries one by one, yielding the videoID of those not downloaded yet.
+        Only the id is kept, the rest of the entry (e.g. its caption lists) is dropped right away.
+        """
+        nonlocal skipped_count, skipped_failed_count
+        for item in tqdm(ijson.items(json_file, 'item'), desc="Scanning for existing files"):
+            video_info_string = item.get('videoID') if isinstance(item, dict) else None
+            if not isinstance(video_info_string, str):
+                # This will be handled properly by the worker, just pass it through
+                yield None
+            elif video_info_string in existing_files:
                 skipped_count += 1
+            elif video_info_string in failed_ids:
+                skipped_failed_count += 1
             else:
-                tasks_to_run.append((item, output_dir))
-        except KeyError:
-            # This will be handled properly by the worker, just pass it through
-            tasks_to_run.append((item, output_dir))
+                yield video_info_string
 
-    if not tasks_to_run:
-        logging.info("All video files already exist. Nothing to download.")
-        logging.info(f"Total files skipped: {skipped_count}")
-        return
-
-    logging.info(f"Found {skipped_count} existing files. Queuing {len(tasks_to_run)} new downloads.")
     logging.info(f"Starting downloads with {num_jobs} parallel jobs...")
 
     success_count = 0
     failure_count = 0
 
-    with multiprocessing.Pool(processes=num_jobs) as pool:
-        # Use imap_unordered for efficiency, as download order doesn't matter
-        results_iterator = pool.imap_unordered(download_worker, tasks_to_run)
+    # Downloads are network-bound and yt-dlp releases the GIL while waiting on I/O,
+    # so threads keep up with processes without the fork and pickling overhead
+    with json_file, ThreadPoolExecutor(max_workers=num_jobs) as executor:
+        # Ids are submitted while the file is still being parsed, so the first downloads
+        # start right away, and only the pending ids (not the parsed entries) are queued
+        try:
+            futures = [executor.submit(download_worker, video_info_string, output_dir)
+                       for video_info_string in pending_ids()]
+        except ijson.JSONError:
+            logging.error(f"Error: Failed to decode JSON from '{json_file_path}'. Check format.")
+            executor.shutdown(cancel_futures=True)
+            sys.exit(1)
+
+        if not futures:
+            logging.info("All video files already exist or failed before. Nothing to download.")
+            logging.info(f"Total files skipped: {skipped_count + skipped_failed_count}")
+            return
+
+        logging.info(
+            f"Found {skipped_count} existing files and {skipped_failed_count} known failures. "
+            f"Queued {len(futures)} new downloads."
+        )
 
-        for _ in tqdm(range(len(tasks_to_run)), desc="Downloading Videos"):
-            success, video_id = next(results_iterator)
+        # Use as_completed for efficiency, as download order doesn't matter
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading Videos"):
+            success, video_id, reason = future.result()
             if success:
                 success_count += 1
             else:
                 failure_count += 1
+                if reason in PERMANENT_FAILURE_REASONS:
+                    failed_ids[video_id] = reason
+
+    # With --retry-failed the old entries were dropped, so the file is rewritten even without new failures
+    if failure_count or retry_failed:
+        save_failed_ids(output_dir, failed_ids)
 
     logging.info("--- Download Summary ---")
     logging.info(f"Successfully downloaded: {success_count}")
     logging.info(f"Skipped (already exist): {skipped_count}")
+    logging.info(f"Skipped (failed before): {skipped_failed_count}")
     logging.info(f"Failed to download:    {failure_count}")
     logging.info("------------------------")
 
@@ -172,8 +276,13 @@ def main():
     parser.add_argument(
         "-j", "--jobs",
         type=int,
-        default=4,
-        help="Number of parallel download jobs to run. (Default: 4)"
+        default=16,
+        help="Number of parallel download threads to run. (Default: 16)"
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help=f"Retry clips recorded as geo-blocked or removed in '{FAILED_FILE_NAME}'."
     )
 
     args = parser.parse_args()
@@ -182,7 +291,7 @@ def main():
         logging.error("Number of jobs must be a positive integer.")
         sys.exit(1)
 
-    process_downloads(args.json_file, args.output_dir, args.jobs)
+    process_downloads(args.json_file, args.output_dir, args.jobs, args.retry_failed)
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
 import os
+import pickle
 
 import pandas as pd
 import pytest
@@ -35,3 +36,28 @@ def test_data_reader(input_file):
 
             assert len(streams.get("audio", [])) > 0
             assert len(streams.get("video", [])) > 0
+
+
+def test_data_reader_pickle():
+    # the distributors pickle the reader to send it to their worker processes
+    reading_config = {
+        "yt_args": {
+            "download_size": 360,
+            "download_audio_rate": 12000,
+        },
+        "timeout": 60,
+        "sampler": None,
+        "cookies_file": "cookies_a.txt,cookies_b.txt",
+        "ffmpeg_count": 2,
+    }
+    video_data_reader = VideoDataReader(
+        encode_formats={"video": "mp4", "audio": "mp3"},
+        tmp_dir="/tmp",
+        reading_config=reading_config,
+    )
+
+    unpickled = pickle.loads(pickle.dumps(video_data_reader))
+
+    assert unpickled.yt_downloader.cookie_files == ["cookies_a.txt", "cookies_b.txt"]
+    assert unpickled.yt_downloader.cookie_index == 0
+    assert unpickled.webfile_downloader.ffmpeg_count == 2
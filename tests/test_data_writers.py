@@ -123,3 +123,44 @@ def test_writer(modalities, writer_type, tmp_path):
         assert len(l) == 1
         if l[0] != output_folder + "/00000.tfrecord":
             raise Exception(l[0] + " is not 00000.tfrecord")
+
+
+@pytest.mark.parametrize("writer_type", ["files", "webdataset"])
+def test_writer_file_streams(writer_type, tmp_path):
+    current_folder = os.path.dirname(__file__)
+    output_folder = str(tmp_path / "test_write")
+    os.mkdir(output_folder)
+
+    schema = pa.schema([pa.field("key", pa.string()), pa.field("status", pa.string())])
+    writer_class = FilesSampleWriter if writer_type == "files" else WebDatasetSampleWriter
+    encode_formats = {"video": "mp4", "audio": "mp3"}
+
+    # video given as a path to a downloaded file, audio as bytes
+    with open(os.path.join(current_folder, "test_files/test_video.mp4"), "rb") as f:
+        video_bytes = f.read()
+    video_path = str(tmp_path / "downloaded.mp4")
+    with open(video_path, "wb") as f:
+        f.write(video_bytes)
+    with open(os.path.join(current_folder, "test_files/test_audio.mp3"), "rb") as f:
+        audio_bytes = f.read()
+
+    writer = writer_class(0, output_folder, True, 5, schema, encode_formats)
+    writer.write(
+        streams={"video": video_path, "audio": audio_bytes},
+        key="0",
+        caption="0",
+        meta={"key": "0", "status": "ok"},
+    )
+    writer.close()
+
+    assert not os.path.exists(video_path)
+    if writer_type == "files":
+        with open(output_folder + "/00000/0.mp4", "rb") as f:
+            assert f.read() == video_bytes
+        with open(output_folder + "/00000/0.mp3", "rb") as f:
+            assert f.read() == audio_bytes
+    else:
+        with tarfile.open(output_folder + "/00000.tar") as tar:
+            assert sorted(tar.getnames()) == ["0.json", "0.mp3", "0.mp4", "0.txt"]
+            assert tar.extractfile("0.mp4").read() == video_bytes
+            assert tar.extractfile("0.mp3").read() == audio_bytes
@@ -1,9 +1,15 @@
 """test video2dataset downloaders"""
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 import pytest
 import ffmpeg
 
 
+from video2dataset import data_reader
 from video2dataset.data_reader import YtDlpDownloader, WebFileDownloader
 
 
@@ -14,6 +20,18 @@ MP4_URL = "https://ak.picdn.net/shutterstock/videos/1053841541/preview/stock-foo
 full_encode_formats = {"video": "mp4", "audio": "m4a"}
 
 
+@pytest.fixture
+def test_files_url():
+    """serves tests/test_files over a local http server, yields its base url"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_files")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(SimpleHTTPRequestHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.mark.parametrize("modalities", [["video", "audio"], ["video"], ["audio"]])
 @pytest.mark.parametrize("video_size", [361, 1080])
 @pytest.mark.parametrize("url", [YT_URL, DM_URL])
@@ -42,12 +60,61 @@ def test_yt_downloader(modalities, video_size, url):
         os.remove(path)
 
 
+def test_yt_downloader_not_clip(test_files_url, tmp_path):
+    ytdlp_downloader = YtDlpDownloader({"yt_metadata_args": None}, str(tmp_path), {"video": "mp4"})
+
+    # twice, so the second download goes through a reused YoutubeDL instance
+    for _ in range(2):
+        modality_paths, _, error_message = ytdlp_downloader(f"{test_files_url}/test_video.mp4")
+        assert error_message is None
+        assert "video" in modality_paths
+        assert os.path.getsize(modality_paths["video"]) > 0
+        os.remove(modality_paths["video"])
+
+
 def test_webfile_downloader():
     webfile_downloader = WebFileDownloader(timeout=10, tmp_dir="/tmp", encode_formats={"video": "mp4"})
 
-    modality_paths, error_message = webfile_downloader(MP4_URL)
+    streams, error_message = webfile_downloader(MP4_URL)
 
     assert error_message is None
-    with open(modality_paths["video"], "rb") as f:
-        assert len(f.read()) > 0
-    os.remove(modality_paths["video"])
+    assert len(streams["video"]) > 0
+
+
+def test_webfile_downloader_cleanup(test_files_url, tmp_path, monkeypatch):
+    def failing_video2audio(video, audio_format, tmp_dir):
+        raise RuntimeError("ffmpeg not found")
+
+    monkeypatch.setattr(data_reader, "video2audio", failing_video2audio)
+    webfile_downloader = WebFileDownloader(timeout=10, tmp_dir=str(tmp_path), encode_formats=full_encode_formats)
+
+    with pytest.raises(RuntimeError):
+        webfile_downloader(f"{test_files_url}/test_video.mp4")
+    assert not os.listdir(tmp_path)
+
+
+def test_webfile_downloader_ffmpeg_count(monkeypatch):
+    active, max_active = 0, 0
+    lock = threading.Lock()
+
+    def counting_video2audio(video, audio_format, tmp_dir):
+        nonlocal active, max_active
+        with lock:
+            active += 1
+            max_active = max(max_active, active)
+        time.sleep(0.2)
+        with lock:
+            active -= 1
+        return None
+
+    monkeypatch.setattr(data_reader, "video2audio", counting_video2audio)
+    webfile_downloader = WebFileDownloader(
+        timeout=10, tmp_dir="/tmp", encode_formats=full_encode_formats, ffmpeg_count=2
+    )
+    video_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_files", "test_video.mp4")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: webfile_downloader(video_path), range(8)))
+
+    assert max_active == 2
+    assert all(len(streams["video"]) > 0 for streams, _ in results)
@@ -3,6 +3,7 @@
 import os
 import uuid
 import requests
+from requests.adapters import HTTPAdapter
 import yt_dlp
 from yt_dlp.utils import download_range_func
 import io
@@ -10,22 +11,115 @@ import webvtt
 import ffmpeg
 import re
 import itertools
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Lock, Semaphore
+
+# VaTeX-style clip ids: "<11 char youtube id>_<start seconds>_<end seconds>"
+_CLIP_RE = re.compile(r"^([\w-]{11})_(\d{6})_(\d{6})$")
+
+# shared by all downloader threads so subtitle and web file requests reuse open connections
+_HTTP_SESSION = requests.Session()
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=32, pool_maxsize=128)
+_HTTP_SESSION.mount("http://", _HTTP_ADAPTER)
+_HTTP_SESSION.mount("https://", _HTTP_ADAPTER)
+
+# responses are read in chunks of this size instead of all at once
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# yt-dlp info fields kept in the metadata, everything else (formats, thumbnails, subtitles...) is dropped
+_YT_INFO_KEYS = (
+    "id",
+    "title",
+    "fulltitle",
+    "display_id",
+    "thumbnail",
+    "description",
+    "uploader",
+    "uploader_id",
+    "uploader_url",
+    "channel",
+    "channel_id",
+    "channel_url",
+    "channel_follower_count",
+    "duration",
+    "duration_string",
+    "view_count",
+    "like_count",
+    "comment_count",
+    "average_rating",
+    "age_limit",
+    "categories",
+    "tags",
+    "chapters",
+    "upload_date",
+    "release_timestamp",
+    "availability",
+    "playable_in_embed",
+    "live_status",
+    "is_live",
+    "was_live",
+    "webpage_url",
+    "original_url",
+    "webpage_url_basename",
+    "webpage_url_domain",
+    "extractor",
+    "extractor_key",
+    "language",
+    "format",
+    "format_id",
+    "format_note",
+    "ext",
+    "filesize_approx",
+    "tbr",
+    "width",
+    "height",
+    "resolution",
+    "fps",
+    "dynamic_range",
+    "vcodec",
+    "vbr",
+    "acodec",
+    "abr",
+    "asr",
+    "audio_channels",
+)
+
+# extensions of directly downloadable files and their modality
+_EXT_MODALITY = {
+    "mp4": "video",
+    "webm": "video",
+    "mov": "video",
+    "avi": "video",
+    "mkv": "video",
+    "mp3": "audio",
+    "wav": "audio",
+    "m4a": "audio",
+}
+
+# temporary file names come from a counter rather than a uuid4 per file, the pid tells apart forked workers
+# and the random prefix (drawn once per import) avoids picking up leftovers of earlier runs in a shared tmp_dir
+_TMP_PREFIX = uuid.uuid4().hex[:12]
+_TMP_COUNTER = itertools.count()
+
+
+def make_tmp_path(tmp_dir, ext):
+    """returns a new unique path in tmp_dir with the given extension"""
+    return f"{tmp_dir}/{_TMP_PREFIX}_{os.getpid()}_{next(_TMP_COUNTER)}.{ext}"
 
 
 def video2audio(video, audio_format, tmp_dir):
     """extract audio from video"""
-    path = f"{tmp_dir}/{str(uuid.uuid4())}.{audio_format}"
-    num_streams = len(ffmpeg.probe(video)["streams"])
+    path = make_tmp_path(tmp_dir, audio_format)
     ffmpeg_args = {"f": audio_format}
 
-    if int(num_streams) > 1:  # video has audio stream
-        try:
-            video = ffmpeg.input(video)
-            (ffmpeg.output(video.audio, path, **ffmpeg_args).run(capture_stderr=True))
-        except ffmpeg.Error as _:
-            path = None
-    else:
+    # no ffprobe beforehand, ffmpeg fails on its own when the video has no audio stream
+    try:
+        video = ffmpeg.input(video)
+        (ffmpeg.output(video.audio, path, **ffmpeg_args).run(capture_stderr=True))
+    except ffmpeg.Error as _:
+        if os.path.exists(path):
+            os.remove(path)
         path = None
     return path
 
@@ -34,26 +128,28 @@ def sub_to_dict(sub, dedupe=True, single=False) -> list:
     """Convert WebVTT to JSON, optionally removing duplicate lines"""
 
     captions = webvtt.read_buffer(io.StringIO(sub))
-    dicts = [{"start": c.start, "end": c.end, "lines": c.lines} for c in captions]
-    if dedupe:
-        dicts = []
-        prev_line = None
-        for c in captions:
-            if any("<c>" in l for l in c.lines):
+    dicts = []
+    prev_line = None
+    for c in captions:
+        lines = c.lines
+        if dedupe:
+            if "<c>" in "\n".join(lines):
                 continue
             # Collect lines that are not dupes
             not_dupe_lines = []
-            for line in c.lines:
+            for line in lines:
                 if not line.strip():
                     continue
                 if line != prev_line:
                     not_dupe_lines.append(line)
                 prev_line = line
-            if not_dupe_lines:
-                dicts.append({"start": c.start, "end": c.end, "lines": not_dupe_lines})
-    if single:
-        for d in dicts:
-            d["line"] = "\n".join(d.pop("lines"))
+            if not not_dupe_lines:
+                continue
+            lines = not_dupe_lines
+        if single:
+            dicts.append({"start": c.start, "end": c.end, "line": "\n".join(lines)})
+        else:
+            dicts.append({"start": c.start, "end": c.end, "lines": lines})
     return dicts
 
 
@@ -89,7 +185,7 @@ def get_yt_meta(url, yt_metadata_args: dict) -> dict:
                 if lang not in info_dict["requested_subtitles"]:
                     continue
                 sub_url = info_dict["requested_subtitles"][lang]["url"]
-                res = requests.get(sub_url, timeout=10)
+                res = _HTTP_SESSION.get(sub_url, timeout=10)
                 sub = io.TextIOWrapper(io.BytesIO(res.content)).read()
                 full_sub_dict[lang] = sub_to_dict(sub)
 
@@ -97,11 +193,7 @@ def get_yt_meta(url, yt_metadata_args: dict) -> dict:
                     break
 
         if yt_metadata_args["get_info"]:
-            info_dict.pop("subtitles")
-            info_dict.pop("requested_formats")
-            info_dict.pop("formats")
-            info_dict.pop("thumbnails")
-            info_dict.pop("automatic_captions")
+            info_dict = {k: info_dict[k] for k in _YT_INFO_KEYS if k in info_dict}
         else:
             info_dict = None
 
@@ -110,57 +202,87 @@ def get_yt_meta(url, yt_metadata_args: dict) -> dict:
         return yt_meta_dict
 
 
+def read_and_remove(path):
+    """read a downloaded temporary file into memory and delete it"""
+    with open(path, "rb") as f:
+        byts = f.read()
+    os.remove(path)
+    return byts
+
+
 def get_file_info(url):
     """returns info about the url (currently extension and modality)"""
-    # TODO: make this nicer
-    video_extensions = ["mp4", "webm", "mov", "avi", "mkv"]
-    audio_extensions = ["mp3", "wav", "m4a"]
-    for ext in video_extensions:
-        if url.endswith(f".{ext}"):
-            return ext, "video"
-    for ext in audio_extensions:
-        if url.endswith(f".{ext}"):
-            return ext, "audio"
-    return None
+    ext = os.path.splitext(url)[1].lower().lstrip(".")
+    modality = _EXT_MODALITY.get(ext)
+    return (ext, modality) if modality is not None else None
 
 
 class WebFileDownloader:
-    """Downloader class for mp4 links"""
+    """Downloader class for mp4 links
+
+    ffmpeg_count: cap on the audio extractions from downloaded video files running at once, unlimited if None.
+        Threads past the cap wait for a free slot. Only this extraction is capped, ffmpeg runs inside
+        yt-dlp (YtDlpDownloader) are not.
+    """
 
-    def __init__(self, timeout, tmp_dir, encode_formats):
+    def __init__(self, timeout, tmp_dir, encode_formats, ffmpeg_count=None):
         self.timeout = timeout
         self.tmp_dir = tmp_dir
         self.encode_formats = encode_formats
+        self.ffmpeg_count = ffmpeg_count
+        self.ffmpeg_semaphore = Semaphore(ffmpeg_count) if ffmpeg_count else None
 
-    def __call__(self, url):
-        modality_paths = {}
+    def __getstate__(self):
+        # the downloader is pickled to reach the worker processes, the semaphore can't be
+        state = self.__dict__.copy()
+        del state["ffmpeg_semaphore"]
+        return state
 
-        ext, modality = get_file_info(url)
-        if not os.path.isfile(url):
-            resp = requests.get(url, stream=True, timeout=self.timeout)
-            byts = resp.content
-        else:  # local files (don't want to delete)
-            with open(url, "rb") as f:
-                byts = f.read()
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.ffmpeg_semaphore = Semaphore(self.ffmpeg_count) if self.ffmpeg_count else None
 
-        modality_path = f"{self.tmp_dir}/{str(uuid.uuid4())}.{ext}"
-        with open(modality_path, "wb") as f:
-            f.write(byts)
+    def __call__(self, url):
+        streams = {}
 
-        modality_paths[modality] = modality_path
+        ext, modality = get_file_info(url)
+        extract_audio = modality == "video" and self.encode_formats.get("audio", None)
 
-        if modality == "video" and self.encode_formats.get("audio", None):
-            audio_format = self.encode_formats["audio"]
-            audio_path = video2audio(modality_paths["video"], audio_format, self.tmp_dir)
-            if audio_path is not None:
-                modality_paths["audio"] = audio_path
+        video_path = None
+        if os.path.isfile(url):  # local files (don't want to delete)
+            with open(url, "rb") as f:
+                streams[modality] = f.read()
+            video_path = url
+        elif not extract_audio:
+            # unlike resp.content this doesn't keep the list of chunks alive next to their joined copy
+            buffer = io.BytesIO()
+            with _HTTP_SESSION.get(url, stream=True, timeout=self.timeout) as resp:
+                for chunk in resp.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+                    buffer.write(chunk)
+            streams[modality] = buffer.getvalue()
+
+        if extract_audio:
+            try:
+                if video_path is None:
+                    # ffmpeg needs a file to extract audio from, so the response goes straight to disk
+                    video_path = make_tmp_path(self.tmp_dir, ext)
+                    with _HTTP_SESSION.get(url, stream=True, timeout=self.timeout) as resp, open(video_path, "wb") as f:
+                        for chunk in resp.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                with self.ffmpeg_semaphore or nullcontext():
+                    audio_path = video2audio(video_path, self.encode_formats["audio"], self.tmp_dir)
+                if audio_path is not None:
+                    streams["audio"] = read_and_remove(audio_path)
+                if video_path != url:
+                    streams[modality] = read_and_remove(video_path)
+            finally:
+                # a failed or interrupted download must not leave its (partial) temporary file behind
+                if video_path not in (None, url) and os.path.exists(video_path):
+                    os.remove(video_path)
 
-        for modality, modality_path in modality_paths.items():
-            if modality not in self.encode_formats:
-                os.remove(modality_path)
-                modality_path.pop(modality)
+        streams = {modality: stream for modality, stream in streams.items() if modality in self.encode_formats}
 
-        return modality_paths, None
+        return streams, None
 
 
 class YtDlpDownloader:
@@ -188,123 +310,181 @@ class YtDlpDownloader:
             self.cookie_files = [cookies_file]
         else:
             self.cookie_files = []
-
         self.cookie_index = 0
 
+        self._init_shared_state()
+
         # TODO: figure out when to do this
         # was relevant with HD videos for loading with decord
         self.specify_codec = False
 
-    def __call__(self, url):
-        import re  # ensure regex module is available in multiprocessing context
+        # the format selectors only depend on the settings above, so they are built once here
+        # (this also keeps the pooled YoutubeDL instances, keyed by format, stable across urls)
+        codec = "[codec=avc1]" if self.specify_codec else ""
+        self._video_fmt = (
+            f"wv*[height>={self.video_size}][ext=mp4]{codec}/"
+            f"w[height>={self.video_size}][ext=mp4]{codec}/"
+            f"bv/b[ext=mp4]{codec}"
+        )
+        self._audio_fmt = f"wa[asr>={self.audio_rate}][ext=m4a] / ba[ext=m4a]" if self.audio_rate > 0 else "ba[ext=m4a]"
+
+    def _init_shared_state(self):
+        """locks and pooled instances shared by the downloading threads, built again in every process"""
+        # round-robin over the cookie files, the lock keeps the rotation even when called from many threads
+        self._cookie_lock = Lock()
+        # writing refreshed cookies back to the files has its own lock so the rotation never waits on disk
+        self._cookie_save_lock = Lock()
+
+        # idle YoutubeDL instances per (format string, cookie file), reused across urls
+        # an instance is only used by one download at a time, so the pool grows to the number of concurrent downloads
+        self._idle_ydls = {}
+        self._ydl_lock = Lock()
+
+    def __getstate__(self):
+        # the downloader is pickled to reach the worker processes, locks and YoutubeDL instances can't be
+        state = self.__dict__.copy()
+        for attr in ("_cookie_lock", "_cookie_save_lock", "_idle_ydls", "_ydl_lock"):
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_shared_state()
 
+    def __call__(self, url):
         modality_paths = {}
         clip_span = None
 
-        match = re.match(r"^([\w-]{11})_(\d{6})_(\d{6})$", url)
+        match = _CLIP_RE.match(url)
         if match:
             video_id, s, e = match.groups()
             clip_span = (int(s), int(e))
             url = f"https://www.youtube.com/watch?v={video_id}"
 
-        video_format_string = (
-            f"wv*[height>={self.video_size}][ext=mp4]{'[codec=avc1]' if self.specify_codec else ''}/"
-            f"w[height>={self.video_size}][ext=mp4]{'[codec=avc1]' if self.specify_codec else ''}/"
-            f"bv/b[ext=mp4]{'[codec=avc1]' if self.specify_codec else ''}"
-        )
-        audio_fmt_string = (
-            f"wa[asr>={self.audio_rate}][ext=m4a] / ba[ext=m4a]" if self.audio_rate > 0 else "ba[ext=m4a]"
-        )
-
         cookie_file = None
         if self.cookie_files:
-            cookie_file = self.cookie_files[self.cookie_index % len(self.cookie_files)]
-            self.cookie_index += 1
-
-        if self.encode_formats.get("audio", None):
-            audio_path_m4a = f"{self.tmp_dir}/{str(uuid.uuid4())}.m4a"
-            ydl_opts = {
-                "outtmpl": audio_path_m4a,
-                "format": audio_fmt_string,
-                "quiet": True,
-            }
-            if cookie_file:
-                ydl_opts["cookiefile"] = cookie_file
-            if clip_span is not None:
-                ydl_opts["download_ranges"] = download_range_func(None, [(clip_span[0], clip_span[1])])
-                ydl_opts["force_keyframes_at_cuts"] = True
-
-            err = None
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ret_code = ydl.download(url)
-                if ret_code != 0 or not os.path.exists(audio_path_m4a):
-                    err = f"yt-dlp exited with status {ret_code}"
-            except Exception as e:  # pylint: disable=(broad-except)
-                err = str(e)
-            if err is not None:
-                print(f"video2dataset error: {err}")
-                if os.path.exists(audio_path_m4a):
-                    os.remove(audio_path_m4a)
-            else:
+            with self._cookie_lock:
+                cookie_file = self.cookie_files[self.cookie_index % len(self.cookie_files)]
+                self.cookie_index += 1
+
+        # audio, video and metadata are independent network requests, run them concurrently
+        # YoutubeDL instances come from a shared pool but each is only used by one download at a time
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            audio_future, video_future = None, None
+            if self.encode_formats.get("audio", None):
+                audio_path_m4a = make_tmp_path(self.tmp_dir, "m4a")
+                audio_future = executor.submit(
+                    self._download, url, audio_path_m4a, self._audio_fmt, cookie_file, clip_span
+                )
+            if self.encode_formats.get("video", None):
+                video_path = make_tmp_path(self.tmp_dir, "mp4")
+                video_future = executor.submit(
+                    self._download, url, video_path, self._video_fmt, cookie_file, clip_span, no_warnings=True
+                )
+            meta_future = executor.submit(self._get_meta, url)
+
+            if audio_future is not None and audio_future.result() is not None:
                 # TODO: look into this, don't think we can just do this
                 # TODO: just figure out a way to download the preferred extension using yt-dlp
                 # audio_path = audio_path_m4a.replace(".m4a", f".{self.encode_formats['audio']}")
-                audio_path = audio_path_m4a
-                modality_paths["audio"] = audio_path
-
-        if self.encode_formats.get("video", None):
-            video_path = f"{self.tmp_dir}/{str(uuid.uuid4())}.mp4"
-            ydl_opts = {
-                "outtmpl": video_path,
-                "format": video_format_string,
-                "quiet": True,
-                "no_warnings": True,
-            }
-            if cookie_file:
-                ydl_opts["cookiefile"] = cookie_file
-            if clip_span is not None:
-                ydl_opts["download_ranges"] = download_range_func(None, [(clip_span[0], clip_span[1])])
-                ydl_opts["force_keyframes_at_cuts"] = True
-
-            err = None
-            try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ret_code = ydl.download(url)
-                if ret_code != 0 or not os.path.exists(video_path):
-                    err = f"yt-dlp exited with status {ret_code}"
-            except Exception as e:  # pylint: disable=(broad-except)
-                err = str(e)
-            if err is not None:
-                print(f"video2dataset error: {err}")
-                if os.path.exists(video_path):
-                    os.remove(video_path)
-            else:
-                modality_paths["video"] = video_path
-
-        err = None
-        try:
-            if self.metadata_args:
-                yt_meta_dict = get_yt_meta(url, self.metadata_args)
-            else:
-                yt_meta_dict = {}
-        except Exception as e:  # pylint: disable=(broad-except)
-            err = str(e)
-            yt_meta_dict = {}
+                modality_paths["audio"] = audio_future.result()
+            if video_future is not None and video_future.result() is not None:
+                modality_paths["video"] = video_future.result()
+            yt_meta_dict = meta_future.result()
 
         if clip_span is not None:
             yt_meta_dict["clips"] = [[clip_span[0], clip_span[1]]]
 
         return modality_paths, yt_meta_dict, None
 
+    def _acquire_ydl(self, format_string, cookie_file, **extra_opts):
+        """take an idle YoutubeDL for this format and cookie file, building one if none is free"""
+        with self._ydl_lock:
+            idle = self._idle_ydls.setdefault((format_string, cookie_file), [])
+            if idle:
+                return idle.pop()
+
+        ydl_opts = {
+            "format": format_string,
+            "quiet": True,
+            **extra_opts,
+        }
+        if cookie_file:
+            ydl_opts["cookiefile"] = cookie_file
+        return yt_dlp.YoutubeDL(ydl_opts)
+
+    def _release_ydl(self, format_string, cookie_file, ydl):
+        if cookie_file:
+            # like YoutubeDL.close() did for the per-url instances, write refreshed cookies back to the file
+            # the lock keeps instances sharing a cookie file from writing it at the same time
+            with self._cookie_save_lock:
+                ydl.save_cookies()
+        with self._ydl_lock:
+            self._idle_ydls[(format_string, cookie_file)].append(ydl)
+
+    def close(self):
+        """close the pooled YoutubeDL instances (saving their cookies), new ones are built on the next call"""
+        with self._ydl_lock:
+            ydls = [ydl for idle in self._idle_ydls.values() for ydl in idle]
+            self._idle_ydls = {}
+        for ydl in ydls:
+            ydl.close()
+
+    def _download(self, url, path, format_string, cookie_file, clip_span, **extra_opts):
+        """download one stream of url to path, returns path or None on failure"""
+        ydl = self._acquire_ydl(format_string, cookie_file, **extra_opts)
+        # only the output path and clip span change between urls
+        ydl.params["outtmpl"]["default"] = path
+        if clip_span is not None:
+            ydl.params["download_ranges"] = download_range_func(None, [(clip_span[0], clip_span[1])])
+            ydl.params["force_keyframes_at_cuts"] = True
+        else:
+            # yt-dlp calls download_ranges whenever the key is set, so it is removed rather than set to None
+            ydl.params.pop("download_ranges", None)
+            ydl.params.pop("force_keyframes_at_cuts", None)
+
+        err = None
+        try:
+            # without ignoreerrors yt-dlp raises DownloadError on failure instead of returning a non-zero code,
+            # the existence check also catches downloads that finished without writing the file
+            ydl.download(url)
+            if not os.path.exists(path):
+                err = "yt-dlp did not write the downloaded file"
+        except Exception as e:  # pylint: disable=(broad-except)
+            err = str(e)
+        finally:
+            self._release_ydl(format_string, cookie_file, ydl)
+        if err is not None:
+            print(f"video2dataset error: {err}")
+            if os.path.exists(path):
+                os.remove(path)
+            return None
+        return path
+
+    def _get_meta(self, url):
+        """get the yt meta dict of url, empty if not requested or on failure"""
+        try:
+            if self.metadata_args:
+                return get_yt_meta(url, self.metadata_args)
+        except Exception:  # pylint: disable=(broad-except)
+            pass
+        return {}
+
 
 class VideoDataReader:
-    """Video data reader provide data for a video"""
+    """Video data reader provide data for a video
 
-    def __init__(self, encode_formats, tmp_dir, reading_config, cookies_file=None):
-        self.webfile_downloader = WebFileDownloader(reading_config["timeout"], tmp_dir, encode_formats)
+    return_paths: if True, files downloaded by yt-dlp are returned as paths instead of being read into memory.
+        The caller then owns (and must remove) those files. Web files are always returned as bytes.
+    """
+
+    def __init__(self, encode_formats, tmp_dir, reading_config, cookies_file=None, return_paths=False):
+        self.webfile_downloader = WebFileDownloader(
+            reading_config["timeout"], tmp_dir, encode_formats, reading_config.get("ffmpeg_count")
+        )
         cookies = cookies_file if cookies_file is not None else reading_config.get("cookies_file")
         self.yt_downloader = YtDlpDownloader(reading_config["yt_args"], tmp_dir, encode_formats, cookies)
+        self.return_paths = return_paths
 
     def __call__(self, row):
         key, url = row
@@ -313,16 +493,19 @@ class VideoDataReader:
         try:
             # TODO: make nice function to detect what type of link we're dealing with
             if get_file_info(url):  # web file that can be directly downloaded
-                modality_paths, error_message = self.webfile_downloader(url)
+                streams, error_message = self.webfile_downloader(url)
             else:
                 modality_paths, meta_dict, error_message = self.yt_downloader(url)
+                if self.return_paths:
+                    streams = modality_paths
+                else:
+                    # yt-dlp can only write to disk, so its files are read back here
+                    streams = {modality: read_and_remove(path) for modality, path in modality_paths.items()}
         except Exception as e:  # pylint: disable=(broad-except)
-            modality_paths, meta_dict, error_message = {}, None, str(e)
-
-        streams = {}
-        for modality, modality_path in modality_paths.items():
-            with open(modality_path, "rb") as modality_file:
-                streams[modality] = modality_file.read()
-            os.remove(modality_path)
+            streams, meta_dict, error_message = {}, None, str(e)
 
         return key, streams, meta_dict, error_message
+
+    def close(self):
+        """release the resources held by the downloaders"""
+        self.yt_downloader.close()
@@ -2,8 +2,12 @@
 
 import json
 import os
+import shutil
+import tarfile
+import time
 
 import fsspec
+from fsspec.implementations.local import LocalFileSystem
 import numpy as np
 import pyarrow as pa
 import pyarrow.parquet as pq
@@ -126,11 +130,18 @@ class WebDatasetSampleWriter:
         self.encode_formats = encode_formats
 
     def write(self, streams, key, caption, meta):
-        """write sample to tars"""
+        """write sample to tars
+
+        streams values can be bytes or paths to local files, files are streamed into the tar and then removed
+        """
         sample = {"__key__": key}
+        file_streams = {}
         for modality, stream in streams.items():
             ext = self.encode_formats[modality] if modality in self.encode_formats else modality
-            sample[ext] = stream
+            if isinstance(stream, str):
+                file_streams[ext] = stream
+            else:
+                sample[ext] = stream
 
         if self.save_caption:
             sample["txt"] = str(caption) if caption is not None else ""
@@ -141,8 +152,25 @@ class WebDatasetSampleWriter:
         sample["json"] = json.dumps(meta, indent=4)
 
         self.tarwriter.write(sample)
+        # written right after the rest of the sample with the same key, so readers see a single sample
+        for ext, path in file_streams.items():
+            self._add_file(f"{key}.{ext}", path)
         self.buffered_parquet_writer.write(meta)
 
+    def _add_file(self, name, path):
+        """copy a local file into the tar in chunks (no full read into memory), then remove it"""
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = os.path.getsize(path)
+        # older webdataset releases have no TarWriter.mtime and always use the current time
+        mtime = getattr(self.tarwriter, "mtime", None)
+        tarinfo.mtime = mtime if mtime is not None else time.time()
+        tarinfo.mode = self.tarwriter.mode
+        tarinfo.uname = self.tarwriter.user
+        tarinfo.gname = self.tarwriter.group
+        with open(path, "rb") as f:
+            self.tarwriter.tarstream.addfile(tarinfo, f)
+        os.remove(path)
+
     def close(self):
         self.buffered_parquet_writer.close()
         self.tarwriter.close()
@@ -292,12 +320,22 @@ class FilesSampleWriter:
         self.encode_formats = encode_formats
 
     def write(self, streams, key, caption, meta):
-        """Write sample to disk"""
+        """Write sample to disk
+
+        streams values can be bytes or paths to local files, files are moved (renamed when possible) into place
+        """
         for modality, stream in streams.items():
             ext = self.encode_formats[modality] if modality in self.encode_formats else modality
             filename = f"{self.subfolder}/{key}.{ext}"
-            with self.fs.open(filename, "wb") as f:
-                f.write(stream)
+            if isinstance(stream, str):
+                if isinstance(self.fs, LocalFileSystem):
+                    shutil.move(stream, filename)
+                else:
+                    self.fs.put_file(stream, filename)
+                    os.remove(stream)
+            else:
+                with self.fs.open(filename, "wb") as f:
+                    f.write(stream)
 
         if self.save_caption:
             caption = str(caption) if caption is not None else ""
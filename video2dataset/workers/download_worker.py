@@ -1,6 +1,7 @@
 """the downloader module handles the downloading"""
 
 import math
+import os
 import time
 import pyarrow as pa
 import traceback
@@ -13,6 +14,7 @@ from typing import List, Any
 import numpy as np
 
 from video2dataset.data_reader import VideoDataReader
+from video2dataset.data_writer import FilesSampleWriter, WebDatasetSampleWriter
 from video2dataset.logger import CappedCounter
 from video2dataset.logger import write_stats
 from video2dataset.subsamplers import (
@@ -56,10 +58,6 @@ class DownloadWorker:
         self.encode_formats = encode_formats
         self.config = config
 
-        self.data_reader = VideoDataReader(
-            encode_formats, tmp_dir, config["reading"], cookies_file=cookies_file
-        )
-
         self.clipping_subsampler = ClippingSubsampler(
             5,  # oom_clip_count
             encode_formats,
@@ -97,6 +95,22 @@ class DownloadWorker:
 
         self.subsamplers = {"video": video_subsamplers, "audio": audio_subsamplers}
 
+        # when no subsampler needs the bytes, downloaded files can go straight from disk into the output
+        # instead of being read into memory and written back out
+        return_paths = (
+            self.sample_writer_class in (WebDatasetSampleWriter, FilesSampleWriter)
+            and self.ffprobe_subsampler is None
+            and self.cut_detector is None
+            and not self.cuts_are_clips
+            and not self.config["storage"]["captions_are_subtitles"]
+            and "clips" not in self.column_list
+            and not video_subsamplers
+            and not audio_subsamplers
+        )
+        self.data_reader = VideoDataReader(
+            encode_formats, tmp_dir, config["reading"], cookies_file=cookies_file, return_paths=return_paths
+        )
+
     def __call__(
         self,
         row,
@@ -179,6 +193,7 @@ class DownloadWorker:
                 self.data_reader,  # pylint: disable=(unnecessary-lambda)
                 loader,
             ):
+                downloaded_paths = [stream for stream in streams.values() if isinstance(stream, str)]
                 try:
                     _, sample_data = shard_to_dl[key]
                     str_key = compute_key(
@@ -201,7 +216,7 @@ class DownloadWorker:
                         raise ValueError("failed_to_download")
 
                     for stream in streams.values():
-                        bytes_downloaded += len(stream)
+                        bytes_downloaded += os.path.getsize(stream) if isinstance(stream, str) else len(stream)
                     for mod in streams:
                         streams[mod] = [streams[mod]]
 
@@ -283,6 +298,11 @@ class DownloadWorker:
                     else:
                         traceback.print_exc()
                         print(f"Sample {key} failed to download: {err}")
+                finally:
+                    # downloaded files the writer didn't take (failed samples) are removed here
+                    for path in downloaded_paths:
+                        if os.path.exists(path):
+                            os.remove(path)
 
                 semaphore.release()
 
@@ -290,6 +310,7 @@ class DownloadWorker:
             thread_pool.terminate()
             thread_pool.join()
             del thread_pool
+            self.data_reader.close()
 
         end_time = time.time()
         write_stats(
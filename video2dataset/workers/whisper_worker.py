@@ -271,6 +271,7 @@ class WhisperWorker:
             _ = semaphore.release() if not from_wds else None
 
         sample_writer.close()
+        self.data_reader.close()
         end_time = time.time()
 
         write_stats(